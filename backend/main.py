@@ -5,10 +5,14 @@ Main FastAPI application server
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from contextlib import asynccontextmanager
+from PIL import Image
+import asyncio
+import io
 import uvicorn
 import os
+import sys
 from dotenv import load_dotenv
 import logging
 from typing import List, Dict, Any
@@ -28,6 +32,31 @@ logger = logging.getLogger(__name__)
 image_processor = None
 recipe_generator = None
 
+def _make_blank_png(size: int = 224) -> bytes:
+    """Encode a black RGB image used to warm up the models"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (size, size)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+_BLACK_PNG_BYTES = _make_blank_png()
+
+async def _warm_up_models():
+    """Run dummy inputs through the models so the first request is not slow"""
+    timeout = float(os.getenv("WARMUP_TIMEOUT", 120))
+    
+    logger.info("Warming up AI models...")
+    try:
+        if image_processor is not None:
+            await asyncio.wait_for(
+                image_processor.identify_ingredients(_BLACK_PNG_BYTES),
+                timeout=timeout
+            )
+        if recipe_generator is not None:
+            await asyncio.wait_for(recipe_generator.warm_up(), timeout=timeout)
+        logger.info("Model warmup completed")
+    except Exception as e:
+        logger.warning(f"Model warmup failed: {e}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize AI models on startup"""
@@ -44,17 +73,22 @@ async def lifespan(app: FastAPI):
         image_processor = None
         recipe_generator = None
     
+    await _warm_up_models()
+    
     yield
     
     # Cleanup (if needed)
     logger.info("Shutting down...")
+    if recipe_generator is not None:
+        await recipe_generator.close()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="RecipeSnap API",
     description="AI-powered cooking assistant that identifies ingredients and suggests recipes",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -220,7 +254,7 @@ async def full_analysis(file: UploadFile = File(...)):
         
         return {
             "ingredients": ingredients,
-            "recipes": [recipe.dict() for recipe in recipes],
+            "recipes": recipes,
             "message": "Analysis completed successfully" + (" (using mock AI responses)" if image_processor is None else "")
         }
     
@@ -231,11 +265,25 @@ async def full_analysis(file: UploadFile = File(...)):
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8001))
     host = os.getenv("HOST", "127.0.0.1")  # Use localhost instead of 0.0.0.0
+    env = os.getenv("ENV", "dev")
     
-    uvicorn.run(
-        "main:app",
-        host=host,
-        port=port,
-        reload=True,
-        log_level="info"
-    ) 
\ No newline at end of file
+    if env == "prod":
+        # Each worker loads its own copy of the models, so size WORKERS to memory
+        uvicorn.run(
+            "main:app",
+            host=host,
+            port=port,
+            workers=int(os.getenv("WORKERS", 1)),
+            loop="uvloop" if sys.platform != "win32" else "asyncio",
+            http="httptools",
+            reload=False,
+            log_level="warning"
+        )
+    else:
+        uvicorn.run(
+            "main:app",
+            host=host,
+            port=port,
+            reload=True,
+            log_level="info"
+        )
@@ -2,11 +2,13 @@
 Pydantic schemas for API request and response models
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict, Any
 
 class Recipe(BaseModel):
     """Recipe model"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     name: str = Field(..., description="Recipe name")
     description: str = Field(..., description="Brief recipe description")
     ingredients: List[str] = Field(..., description="List of ingredients needed")
@@ -19,12 +21,16 @@ class Recipe(BaseModel):
 
 class IngredientResponse(BaseModel):
     """Response model for ingredient identification"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     ingredients: List[str] = Field(..., description="List of identified ingredients")
     message: str = Field(..., description="Response message")
     confidence_scores: Optional[Dict[str, float]] = Field(None, description="Confidence scores for each ingredient")
 
 class RecipeResponse(BaseModel):
     """Response model for recipe generation"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     recipes: List[Recipe] = Field(..., description="List of generated recipes")
     ingredients_used: List[str] = Field(..., description="Ingredients that were used for recipe generation")
     message: str = Field(..., description="Response message")
@@ -0,0 +1,91 @@
+"""
+Micro-batching Service
+Coalesces concurrent requests into a single batched model call
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """
+    Dynamic batcher that groups items submitted within a short time window
+    and processes them together with one call to ``batch_fn``
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch_size: int = 8,
+        max_wait: float = 0.005
+    ):
+        """
+        Args:
+            batch_fn: Blocking function mapping a list of items to a list of
+                results of the same length. Runs in the batcher's own thread.
+            max_batch_size: Maximum number of items processed in one call
+            max_wait: Seconds to wait for more items after the first arrives
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        # Batches run one at a time anyway, and a single dedicated thread keeps
+        # thread-local GPU state (e.g. CUDA graph trees) from being rebuilt
+        # on whichever default-executor thread picks up the next batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="micro-batcher")
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_worker(self):
+        """Start the background worker on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item for the next batch and wait for its result"""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _run(self):
+        """Collect queued items into batches and dispatch them"""
+        while True:
+            batch = [await self._queue.get()]
+
+            # Give concurrent requests a short window to join the batch
+            await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            # Skip items whose callers have already gone away
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            logger.debug(f"Running batch of {len(batch)} items")
+
+            try:
+                results = await self._loop.run_in_executor(
+                    self._executor,
+                    self.batch_fn,
+                    [item for item, _ in batch]
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
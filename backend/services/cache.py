@@ -0,0 +1,44 @@
+"""
+Result Cache Service
+Size-bounded LRU cache for memoizing expensive model results
+"""
+
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+class LRUCache:
+    """
+    Least-recently-used cache holding at most ``maxsize`` entries
+    """
+
+    def __init__(self, maxsize: int = 256):
+        """Create an empty cache, a maxsize of 0 disables caching"""
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Return the cached value and mark it as recently used"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
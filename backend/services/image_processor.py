@@ -4,23 +4,55 @@ Handles image captioning and object detection for ingredient identification
 """
 
 import torch
-from transformers import (
-    VisionEncoderDecoderModel, 
-    ViTImageProcessor, 
-    AutoTokenizer,
-    DetrImageProcessor,
-    DetrForObjectDetection
-)
 from PIL import Image
+import numpy as np
+import ahocorasick
+import contextlib
+import hashlib
 import io
 import logging
 import os
-import re
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 import asyncio
 
+from services.batching import MicroBatcher
+from services.cache import LRUCache
+from services.model_utils import compile_model, quantize_model
+
 logger = logging.getLogger(__name__)
 
+# Common food ingredients for filtering
+FOOD_KEYWORDS = {
+    'vegetables': ('tomato', 'onion', 'carrot', 'potato', 'pepper', 'lettuce', 'spinach',
+                   'broccoli', 'cauliflower', 'cucumber', 'celery', 'garlic', 'ginger',
+                   'mushroom', 'corn', 'peas', 'beans', 'cabbage', 'zucchini', 'eggplant'),
+    'fruits': ('apple', 'banana', 'orange', 'lemon', 'lime', 'strawberry', 'blueberry',
+               'grape', 'pineapple', 'mango', 'avocado', 'peach', 'pear', 'cherry'),
+    'proteins': ('chicken', 'beef', 'pork', 'fish', 'salmon', 'tuna', 'shrimp', 'egg',
+                 'tofu', 'cheese', 'milk', 'yogurt', 'turkey', 'ham', 'bacon'),
+    'grains': ('rice', 'pasta', 'bread', 'flour', 'oats', 'quinoa', 'barley', 'wheat'),
+    'herbs_spices': ('basil', 'oregano', 'thyme', 'rosemary', 'parsley', 'cilantro',
+                     'mint', 'sage', 'salt', 'pepper', 'paprika', 'cumin', 'turmeric'),
+    'pantry': ('oil', 'butter', 'sugar', 'honey', 'vinegar', 'soy sauce', 'olive oil')
+}
+
+# Flatten all food keywords
+ALL_FOOD_ITEMS = tuple(item for category in FOOD_KEYWORDS.values() for item in category)
+ALL_FOOD_SET = frozenset(ALL_FOOD_ITEMS)
+
+# Lowercase -> display name lookup for keyword matching
+FOOD_TITLES = {item.lower(): item.title() for item in ALL_FOOD_ITEMS}
+
+# Shortest edge DETR resizes to; no model needs more resolution than this
+DECODE_MIN_SIDE = 800
+
+def _is_word_boundary(text: str, index: int) -> bool:
+    """Check that the character at index does not continue a word"""
+    if index < 0 or index >= len(text):
+        return True
+    char = text[index]
+    return not (char.isalnum() or char == '_')
+
 class ImageProcessor:
     """
     Image processor for identifying ingredients using AI models
@@ -31,6 +63,16 @@ class ImageProcessor:
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         logger.info(f"Using device: {self.device}")
         
+        # Half precision on GPU, optional int8 dynamic quantization on CPU
+        self.dtype = torch.float16 if self.device.type == "cuda" else torch.float32
+        self.quantize = os.getenv("QUANTIZE_MODELS", "true").lower() == "true"
+        
+        # Captions only feed keyword matching, so greedy decoding is enough
+        self.caption_num_beams = int(os.getenv("CAPTION_NUM_BEAMS", 1))
+        
+        # Dedicated stream so host-to-device copies overlap with other GPU work
+        self._stream = torch.cuda.Stream(device=self.device) if self.device.type == "cuda" else None
+        
         # Model cache directory
         self.cache_dir = os.getenv("MODEL_CACHE_DIR", "./models_cache")
         os.makedirs(self.cache_dir, exist_ok=True)
@@ -39,35 +81,43 @@ class ImageProcessor:
         self._load_captioning_model()
         self._load_object_detection_model()
         
-        # Common food ingredients for filtering
-        self.food_keywords = {
-            'vegetables': ['tomato', 'onion', 'carrot', 'potato', 'pepper', 'lettuce', 'spinach', 
-                          'broccoli', 'cauliflower', 'cucumber', 'celery', 'garlic', 'ginger',
-                          'mushroom', 'corn', 'peas', 'beans', 'cabbage', 'zucchini', 'eggplant'],
-            'fruits': ['apple', 'banana', 'orange', 'lemon', 'lime', 'strawberry', 'blueberry',
-                      'grape', 'pineapple', 'mango', 'avocado', 'peach', 'pear', 'cherry'],
-            'proteins': ['chicken', 'beef', 'pork', 'fish', 'salmon', 'tuna', 'shrimp', 'egg',
-                        'tofu', 'cheese', 'milk', 'yogurt', 'turkey', 'ham', 'bacon'],
-            'grains': ['rice', 'pasta', 'bread', 'flour', 'oats', 'quinoa', 'barley', 'wheat'],
-            'herbs_spices': ['basil', 'oregano', 'thyme', 'rosemary', 'parsley', 'cilantro',
-                           'mint', 'sage', 'salt', 'pepper', 'paprika', 'cumin', 'turmeric'],
-            'pantry': ['oil', 'butter', 'sugar', 'honey', 'vinegar', 'soy sauce', 'olive oil']
-        }
+        # Coalesce concurrent requests into batched forward passes
+        max_batch_size = int(os.getenv("IMAGE_BATCH_SIZE", 8))
+        batch_window = float(os.getenv("IMAGE_BATCH_WINDOW_MS", 5)) / 1000
+        self._batcher = MicroBatcher(
+            self._analyze_batch,
+            max_batch_size=max_batch_size,
+            max_wait=batch_window
+        )
         
-        # Flatten all food keywords
-        self.all_food_items = []
-        for category in self.food_keywords.values():
-            self.all_food_items.extend(category)
+        # Remember results for recently seen images
+        self._result_cache = LRUCache(maxsize=int(os.getenv("RESULT_CACHE_SIZE", 256)))
+        self._inflight: Dict[bytes, asyncio.Future] = {}
+        
+        # Shared, immutable keyword tables
+        self.food_keywords = FOOD_KEYWORDS
+        self.all_food_items = ALL_FOOD_ITEMS
+        self._food_title = FOOD_TITLES
+        
+        # Build a single automaton that finds every food keyword in one pass
+        self._food_automaton = ahocorasick.Automaton()
+        for keyword in self._food_title:
+            self._food_automaton.add_word(keyword, keyword)
+        self._food_automaton.make_automaton()
     
     def _load_captioning_model(self):
         """Load the image captioning model"""
         try:
+            # Imported here so the heavy model modules load only when needed
+            from transformers import VisionEncoderDecoderModel, ViTImageProcessor, AutoTokenizer
+            
             logger.info("Loading image captioning model...")
             model_name = "nlpconnect/vit-gpt2-image-captioning"
             
             self.caption_model = VisionEncoderDecoderModel.from_pretrained(
                 model_name, 
-                cache_dir=self.cache_dir
+                cache_dir=self.cache_dir,
+                torch_dtype=self.dtype
             )
             self.caption_processor = ViTImageProcessor.from_pretrained(
                 model_name,
@@ -80,6 +130,9 @@ class ImageProcessor:
             
             self.caption_model.to(self.device)
             self.caption_model.eval()
+            # Not compiled: autoregressive decoding grows its KV cache every step,
+            # which would keep re-recording CUDA graphs
+            self.caption_model = quantize_model(self.caption_model, self.device, self.quantize)
             
             logger.info("Image captioning model loaded successfully")
             
@@ -90,6 +143,8 @@ class ImageProcessor:
     def _load_object_detection_model(self):
         """Load the object detection model"""
         try:
+            from transformers import DetrImageProcessor, DetrForObjectDetection
+            
             logger.info("Loading object detection model...")
             model_name = "facebook/detr-resnet-50"
             
@@ -99,11 +154,16 @@ class ImageProcessor:
             )
             self.detection_model = DetrForObjectDetection.from_pretrained(
                 model_name,
-                cache_dir=self.cache_dir
+                cache_dir=self.cache_dir,
+                torch_dtype=self.dtype
             )
             
             self.detection_model.to(self.device)
             self.detection_model.eval()
+            self.detection_model = quantize_model(self.detection_model, self.device, self.quantize)
+            # Image sizes vary per batch, so compile with dynamic shapes and
+            # without CUDA graphs, which would be recorded once per shape
+            compile_model(self.detection_model, self.device, self.cache_dir, dynamic=True)
             
             logger.info("Object detection model loaded successfully")
             
@@ -111,99 +171,151 @@ class ImageProcessor:
             logger.error(f"Failed to load object detection model: {e}")
             raise e
     
-    def _preprocess_image(self, image_data: bytes) -> Image.Image:
-        """Preprocess image data"""
+    def _preprocess_image(self, image_data: bytes) -> np.ndarray:
+        """Decode image data into an RGB array"""
         try:
             image = Image.open(io.BytesIO(image_data))
             
+            # Let libjpeg-turbo downscale large photos while decoding instead
+            # of decoding at full resolution and resizing afterwards
+            if image.format == "JPEG":
+                image.draft("RGB", (DECODE_MIN_SIDE, DECODE_MIN_SIDE))
+            
             # Convert to RGB if necessary
             if image.mode != 'RGB':
                 image = image.convert('RGB')
             
-            return image
+            # Image.open is lazy, so the actual decode happens here
+            return np.asarray(image)
             
         except Exception as e:
             logger.error(f"Failed to preprocess image: {e}")
             raise e
     
-    def _generate_caption(self, image: Image.Image) -> str:
-        """Generate caption for the image"""
+    def _to_device(self, tensor: torch.Tensor, dtype=None) -> torch.Tensor:
+        """Move a tensor to the model device, copying asynchronously from pinned memory on GPU"""
+        if self._stream is None:
+            return tensor.to(self.device, dtype=dtype)
+        # Copy in the source dtype and cast on the device; casting during the
+        # transfer would convert on the host first and block on that copy
+        tensor = tensor.pin_memory().to(self.device, non_blocking=True)
+        return tensor if dtype is None else tensor.to(dtype)
+    
+    def _device_stream(self):
+        """Context that runs GPU work on the dedicated inference stream"""
+        if self._stream is None:
+            return contextlib.nullcontext()
+        return torch.cuda.stream(self._stream)
+    
+    def _wait_for_stream(self):
+        """Make the current stream wait for queued inference work before reading results"""
+        if self._stream is not None:
+            torch.cuda.current_stream(self.device).wait_stream(self._stream)
+    
+    def _generate_captions(self, images: List[np.ndarray]) -> List[Optional[str]]:
+        """Generate captions for a batch of images, None for each image if the model failed"""
         try:
-            # Process image
-            pixel_values = self.caption_processor(
-                images=image, 
-                return_tensors="pt"
-            ).pixel_values.to(self.device)
-            
-            # Generate caption
-            with torch.no_grad():
-                output_ids = self.caption_model.generate(
-                    pixel_values,
-                    max_length=50,
-                    num_beams=4,
-                    early_stopping=True
+            with self._device_stream():
+                # Process all images into one stacked tensor
+                pixel_values = self._to_device(
+                    self.caption_processor(images=images, return_tensors="pt").pixel_values,
+                    dtype=self.dtype
                 )
+                
+                # Generate captions
+                with torch.inference_mode():
+                    output_ids = self.caption_model.generate(
+                        pixel_values,
+                        max_new_tokens=20,
+                        num_beams=self.caption_num_beams,
+                        do_sample=False,
+                        use_cache=True,
+                        early_stopping=self.caption_num_beams > 1
+                    )
+            
+            self._wait_for_stream()
             
-            # Decode caption
-            caption = self.caption_tokenizer.decode(
-                output_ids[0], 
+            # Decode captions
+            captions = self.caption_tokenizer.batch_decode(
+                output_ids, 
                 skip_special_tokens=True
             )
             
-            return caption.strip()
+            return [caption.strip() for caption in captions]
             
         except Exception as e:
             logger.error(f"Failed to generate caption: {e}")
-            return ""
+            return [None] * len(images)
     
-    def _detect_objects(self, image: Image.Image) -> List[Dict]:
-        """Detect objects in the image"""
+    def _detect_objects_batch(self, images: List[np.ndarray]) -> List[Optional[List[Dict]]]:
+        """Detect objects in a batch of images, None for each image if the model failed"""
         try:
-            # Process image
-            inputs = self.detection_processor(images=image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            # Detect objects
-            with torch.no_grad():
-                outputs = self.detection_model(**inputs)
-            
-            # Process results
-            target_sizes = torch.tensor([image.size[::-1]]).to(self.device)
-            results = self.detection_processor.post_process_object_detection(
-                outputs, 
-                target_sizes=target_sizes, 
-                threshold=0.5
-            )[0]
-            
-            detected_objects = []
-            for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
-                object_name = self.detection_model.config.id2label[label.item()]
-                confidence = score.item()
+            with self._device_stream():
+                # Process images (the processor pads them to a common size)
+                inputs = self.detection_processor(images=images, return_tensors="pt")
+                inputs = {
+                    k: self._to_device(v, dtype=self.dtype if v.is_floating_point() else None)
+                    for k, v in inputs.items()
+                }
                 
-                detected_objects.append({
-                    "name": object_name,
-                    "confidence": confidence,
-                    "box": box.tolist()
-                })
+                # Detect objects
+                with torch.inference_mode():
+                    outputs = self.detection_model(**inputs)
+                
+                # Process results
+                target_sizes = torch.tensor([image.shape[:2] for image in images]).to(self.device)
+                batch_results = self.detection_processor.post_process_object_detection(
+                    outputs, 
+                    target_sizes=target_sizes, 
+                    threshold=0.5
+                )
             
-            return detected_objects
+            self._wait_for_stream()
+            
+            id2label = self.detection_model.config.id2label
+            batch_objects = []
+            for results in batch_results:
+                # post_process already applied the threshold; copy each surviving
+                # tensor to the host once instead of syncing per detection
+                scores = results["scores"].cpu().tolist()
+                labels = results["labels"].cpu().tolist()
+                boxes = results["boxes"].cpu().tolist()
+                
+                batch_objects.append([
+                    {
+                        "name": id2label[label],
+                        "confidence": score,
+                        "box": box
+                    }
+                    for score, label, box in zip(scores, labels, boxes)
+                ])
+            
+            return batch_objects
             
         except Exception as e:
             logger.error(f"Failed to detect objects: {e}")
-            return []
+            return [None] * len(images)
+    
+    def _analyze_batch(self, images: List[np.ndarray]) -> List[Tuple[Optional[str], Optional[List[Dict]]]]:
+        """Caption and detect objects for a batch of images"""
+        # Both models share the device, so running them back to back in one
+        # worker avoids two threads contending for it
+        captions = self._generate_captions(images)
+        batch_objects = self._detect_objects_batch(images)
+        return list(zip(captions, batch_objects))
     
     def _extract_ingredients_from_text(self, text: str) -> List[str]:
         """Extract food ingredients from text using keyword matching"""
         text_lower = text.lower()
         found_ingredients = []
         
-        for ingredient in self.all_food_items:
-            # Use word boundaries to avoid partial matches
-            pattern = r'\b' + re.escape(ingredient.lower()) + r'\b'
-            if re.search(pattern, text_lower):
-                found_ingredients.append(ingredient.title())
+        for end, keyword in self._food_automaton.iter(text_lower):
+            start = end - len(keyword) + 1
+            # Only accept whole-word matches to avoid partial matches
+            if _is_word_boundary(text_lower, start - 1) and _is_word_boundary(text_lower, end + 1):
+                found_ingredients.append(self._food_title[keyword])
         
-        return list(set(found_ingredients))  # Remove duplicates
+        return list(dict.fromkeys(found_ingredients))  # Remove duplicates, keep order
     
     def _filter_food_objects(self, objects: List[Dict]) -> List[str]:
         """Filter detected objects to keep only food-related items"""
@@ -212,37 +324,50 @@ class ImageProcessor:
         for obj in objects:
             object_name = obj["name"].lower()
             
-            # Check if the detected object is food-related
-            if any(food_item in object_name for food_item in self.all_food_items):
+            # Check if the detected object, or any word of it, is a known food
+            if object_name in ALL_FOOD_SET or not ALL_FOOD_SET.isdisjoint(object_name.split()):
                 food_objects.append(obj["name"].title())
-            
-            # Also check for common food containers/items
-            food_containers = ['bowl', 'plate', 'cup', 'bottle', 'jar', 'can']
-            if any(container in object_name for container in food_containers):
-                # Don't add the container itself, but it indicates food presence
-                continue
         
-        return list(set(food_objects))
+        return list(dict.fromkeys(food_objects))
     
     async def identify_ingredients(self, image_data: bytes) -> List[str]:
         """
         Main method to identify ingredients from image
         Combines image captioning and object detection
         """
+        # Serve duplicate uploads from the cache
+        key = hashlib.blake2b(image_data, digest_size=16).digest()
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            logger.info(f"Using cached ingredients: {cached}")
+            return list(cached)
+        
+        # Identical uploads already being processed share the same task
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._identify_uncached(key, image_data))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shield so one cancelled request does not cancel the others
+        return list(await asyncio.shield(task))
+    
+    async def _identify_uncached(self, key: bytes, image_data: bytes) -> List[str]:
+        """Run the models on an image and cache the identified ingredients"""
         try:
-            # Preprocess image
-            image = self._preprocess_image(image_data)
+            # Decode once into an RGB array shared by both model processors.
+            # Pillow releases the GIL while decoding, so a worker thread keeps
+            # the event loop free without copying pixels between processes.
+            image = await asyncio.to_thread(self._preprocess_image, image_data)
             
-            # Run both models concurrently
-            caption_task = asyncio.create_task(
-                asyncio.to_thread(self._generate_caption, image)
-            )
-            objects_task = asyncio.create_task(
-                asyncio.to_thread(self._detect_objects, image)
-            )
+            # Run both models, batched with other pending requests
+            caption, detected_objects = await self._batcher.submit(image)
             
-            # Wait for both tasks to complete
-            caption, detected_objects = await asyncio.gather(caption_task, objects_task)
+            # Carry on with whatever succeeded, but only cache complete results
+            # so a transient failure (e.g. CUDA OOM) is retried next time
+            complete = caption is not None and detected_objects is not None
+            caption = caption or ""
+            detected_objects = detected_objects or []
             
             logger.info(f"Generated caption: {caption}")
             logger.info(f"Detected {len(detected_objects)} objects")
@@ -254,12 +379,15 @@ class ImageProcessor:
             object_ingredients = self._filter_food_objects(detected_objects)
             
             # Combine and deduplicate ingredients
-            all_ingredients = list(set(caption_ingredients + object_ingredients))
+            all_ingredients = list(dict.fromkeys(caption_ingredients + object_ingredients))
             
             logger.info(f"Identified ingredients: {all_ingredients}")
             
+            if complete:
+                self._result_cache.put(key, all_ingredients)
+            
             return all_ingredients
             
         except Exception as e:
             logger.error(f"Failed to identify ingredients: {e}")
-            raise e 
\ No newline at end of file
+            raise e
@@ -0,0 +1,47 @@
+"""
+Model Utilities
+Precision and compilation helpers shared by the model services
+"""
+
+import torch
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+def quantize_model(model, device: torch.device, enabled: bool = True):
+    """Apply int8 dynamic quantization to linear layers when running on CPU"""
+    if device.type != "cpu" or not enabled:
+        return model
+
+    try:
+        return torch.quantization.quantize_dynamic(
+            model,
+            {torch.nn.Linear},
+            dtype=torch.qint8
+        )
+    except Exception as e:
+        logger.warning(f"Int8 quantization failed, using full precision: {e}")
+        return model
+
+def torch_compile_enabled(device: torch.device, cache_dir: str) -> bool:
+    """Check whether torch.compile should be used and set up its kernel cache"""
+    # Inductor on CPU tends to regress for quantized, small-batch inference
+    if device.type != "cuda" or os.getenv("TORCH_COMPILE", "true").lower() != "true":
+        return False
+
+    # Persist compiled kernels so restarts skip most of the compile time
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
+    return True
+
+def compile_model(model, device: torch.device, cache_dir: str, **compile_kwargs) -> bool:
+    """Compile the model forward pass in place when running on GPU"""
+    if not torch_compile_enabled(device, cache_dir):
+        return False
+
+    try:
+        model.forward = torch.compile(model.forward, **compile_kwargs)
+        return True
+    except Exception as e:
+        logger.warning(f"torch.compile failed, using eager mode: {e}")
+        return False
@@ -1,45 +1,168 @@
 """
 Recipe Generation Service
-Uses Mistral AI model to generate recipes based on identified ingredients
+Uses an instruction-tuned language model to generate recipes based on identified ingredients
 """
 
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, CompileConfig
+from transformers.utils import is_flash_attn_2_available
 import logging
 import os
-import json
+import copy
+import functools
+import orjson
+import platform
 import re
-from typing import List, Dict, Any
-import asyncio
+from typing import List, Dict, Any, Optional, Tuple
+import uuid
 
 from models.schemas import Recipe
+from services.batching import MicroBatcher
+from services.cache import LRUCache
+from services.model_utils import quantize_model, torch_compile_enabled
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_RECIPE_MODEL = "Qwen/Qwen2.5-1.5B-Instruct"
+
+# Probing the CUDA driver is slow, so do it once per process
+_DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+_INGREDIENTS_RE = re.compile(r'Available ingredients: (.+)')
+
+# Headroom for the ingredient list when sizing the vLLM context window
+_MAX_INGREDIENT_TOKENS = 256
+
+def _ort_quantization_config():
+    """Pick the ONNX Runtime dynamic int8 config for this CPU's instruction set"""
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+    
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        flags = set()
+    
+    if "avx512_vnni" in flags:
+        return AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    if "avx512f" in flags:
+        return AutoQuantizationConfig.avx512(is_static=False, per_channel=False)
+    return AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+
+def _find_json_object(text: str) -> Optional[str]:
+    """Return the first balanced JSON object in text using a single linear scan"""
+    depth = 0
+    start = -1
+    in_string = False
+    escaped = False
+    
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            if depth > 0:
+                in_string = True
+        elif char == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == '}' and depth > 0:
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    
+    return None
+
+_STIR_FRY_EXTRAS = ("soy sauce", "garlic", "ginger", "oil")
+_SALAD_EXTRAS = ("olive oil", "lemon juice", "salt", "pepper")
+
+@functools.lru_cache(maxsize=256)
+def _mock_recipes_json(ingredients: Tuple[str, ...]) -> str:
+    """Build the mock recipe JSON, memoized since it only depends on the ingredients"""
+    first = ingredients[0] if ingredients else None
+    second = ingredients[1] if len(ingredients) > 1 else None
+    stir_fry_featuring = ", ".join(ingredients[:3]) if len(ingredients) >= 3 else "fresh ingredients"
+    salad_featuring = ", ".join(ingredients[:2]) if len(ingredients) >= 2 else "seasonal ingredients"
+    
+    # Create mock recipes
+    mock_recipes = {
+        "recipes": [
+            {
+                "name": f"Quick {first or 'Vegetable'} Stir Fry",
+                "description": f"A delicious and quick stir fry featuring {stir_fry_featuring}",
+                "ingredients": [*ingredients, *_STIR_FRY_EXTRAS],
+                "instructions": [
+                    "Heat oil in a large pan or wok over medium-high heat",
+                    "Add garlic and ginger, stir for 30 seconds",
+                    f"Add {first or 'vegetables'} and cook for 3-4 minutes",
+                    "Add remaining ingredients and stir fry for 2-3 minutes",
+                    "Season with soy sauce and serve hot"
+                ],
+                "prep_time": "10 minutes",
+                "cook_time": "8 minutes",
+                "servings": 2,
+                "difficulty": "Easy",
+                "cuisine_type": "Asian"
+            },
+            {
+                "name": f"Simple {second or 'Garden'} Salad",
+                "description": f"Fresh and healthy salad with {salad_featuring}",
+                "ingredients": [*ingredients, *_SALAD_EXTRAS],
+                "instructions": [
+                    "Wash and prepare all vegetables",
+                    "Cut ingredients into bite-sized pieces",
+                    "Combine all ingredients in a large bowl",
+                    "Drizzle with olive oil and lemon juice",
+                    "Season with salt and pepper, toss and serve"
+                ],
+                "prep_time": "15 minutes",
+                "cook_time": "0 minutes",
+                "servings": 2,
+                "difficulty": "Easy",
+                "cuisine_type": "Mediterranean"
+            }
+        ]
+    }
+    
+    return orjson.dumps(mock_recipes).decode()
+
 class RecipeGenerator:
     """
-    Recipe generator using Mistral AI model
+    Recipe generator using an instruction-tuned language model
     """
     
     def __init__(self):
         """Initialize the recipe generation model"""
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = _DEVICE
         logger.info(f"Using device: {self.device}")
         
+        # Small instruction-tuned models handle the JSON recipe prompt well;
+        # larger ones such as Mistral-7B load only when requested explicitly
+        self.model_name = os.getenv("RECIPE_MODEL", DEFAULT_RECIPE_MODEL)
+        
+        # 4-bit weights on GPU, int8 dynamic quantization on CPU
+        self.quantize = os.getenv("QUANTIZE_MODELS", "true").lower() == "true"
+        
+        # Token budget for the JSON answer, sized for the two recipes the prompt asks for
+        self.max_new_tokens = int(os.getenv("RECIPE_MAX_NEW_TOKENS", 768))
+        
         # Model cache directory
         self.cache_dir = os.getenv("MODEL_CACHE_DIR", "./models_cache")
         os.makedirs(self.cache_dir, exist_ok=True)
         
-        # Initialize model
-        self._load_model()
-        
         # Recipe templates and prompts
         self.recipe_prompt_template = """
 You are a professional chef and recipe creator. Given a list of ingredients, create detailed, delicious recipes that make the best use of these ingredients.
 
-Available ingredients: {ingredients}
-
-Please create 2-3 different recipes using these ingredients. For each recipe, provide:
+Please create exactly 2 different recipes using the available ingredients listed below. For each recipe, provide:
 1. Recipe name
 2. Brief description
 3. Complete ingredient list (including quantities)
@@ -67,85 +190,447 @@ Format your response as JSON with the following structure:
     ]
 }}
 
-Make sure the recipes are practical, delicious, and use the available ingredients effectively.
+Make sure the recipes are practical, delicious, and use the available ingredients effectively. Keep each description to one sentence and each recipe to at most 8 short instruction steps.
+
+Available ingredients: {ingredients}
 """
+        
+        # Inference engine: "hf" (transformers, default), "vllm", "onnx" or "tgi"
+        self.engine_type = os.getenv("RECIPE_ENGINE", "hf").lower()
+        self.engine = None
+        self._static_cache = False
+        self._compiled = False
+        
+        # Initialize model
+        loaded = False
+        if self.engine_type == "vllm":
+            loaded = self._load_vllm_engine()
+        elif self.engine_type == "onnx":
+            loaded = self._load_onnx_model()
+        elif self.engine_type == "tgi":
+            loaded = self._load_tgi_client()
+        
+        if not loaded:
+            self.engine_type = "hf"
+            self._load_model()
+        
+        # Inference servers tokenize with special tokens, so drop the BOS the
+        # chat template already put at the start of the prompt
+        self._server_bos = self._template_bos() if self.engine_type in ("vllm", "tgi") else ""
+        
+        # Coalesce concurrent requests into one padded generate() call
+        max_batch_size = int(os.getenv("RECIPE_BATCH_SIZE", 8))
+        batch_window = float(os.getenv("RECIPE_BATCH_WINDOW_MS", 20)) / 1000
+        self._batcher = MicroBatcher(
+            self._generate_batch,
+            max_batch_size=max_batch_size,
+            max_wait=batch_window
+        )
+        
+        # Remember recipes for recently requested ingredient sets
+        self._recipe_cache = LRUCache(maxsize=int(os.getenv("RESULT_CACHE_SIZE", 256)))
+        
+        # The ingredients come last, so everything before them is identical
+        # across requests and its KV cache can be computed once and reused.
+        # The compiled decode step replays CUDA graphs that need the fixed
+        # shapes of the static cache, so that setup gets graphs instead of a
+        # prefix KV cache (a growing dynamic cache would re-record a graph
+        # every step).
+        self._prefix_text = None
+        self._prefix_ids = None
+        self._prefix_cache = None
+        if self.model is not None and self.engine_type == "hf":
+            self._compiled = self._configure_compile()
+            self._prepare_prefix_cache(with_kv=not self._compiled)
     
     def _load_model(self):
-        """Load the Mistral model"""
+        """Load the recipe generation model"""
         try:
-            logger.info("Loading Mistral model for recipe generation...")
-            model_name = "mistralai/Mistral-7B-Instruct-v0.1"
+            model_name = self.model_name
+            logger.info(f"Loading {model_name} for recipe generation...")
             
             # Load tokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(
                 model_name,
-                cache_dir=self.cache_dir,
-                trust_remote_code=True
+                cache_dir=self.cache_dir
             )
             
             # Add padding token if not present
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
             
-            # Load model with appropriate settings for CPU/GPU
+            # Half precision halves weight bandwidth; int8 dynamic quantization
+            # on CPU needs fp32 weights to start from
+            if self.device.type == "cuda":
+                dtype = torch.float16
+            elif self.quantize:
+                dtype = torch.float32
+            else:
+                dtype = torch.bfloat16
+            
+            # Materialize the weights directly on the target device
             model_kwargs = {
                 "cache_dir": self.cache_dir,
-                "trust_remote_code": True,
-                "torch_dtype": torch.float16 if self.device.type == "cuda" else torch.float32,
-                "low_cpu_mem_usage": True
+                "torch_dtype": dtype,
+                "low_cpu_mem_usage": True,
+                "device_map": {"": self.device},
+                "attn_implementation": self._attn_implementation()
             }
             
-            # For CPU, use smaller precision and enable optimizations
-            if self.device.type == "cpu":
-                model_kwargs.update({
-                    "torch_dtype": torch.float32,
-                    "device_map": None
-                })
+            # NF4 weights cut memory bandwidth, the bottleneck when decoding
+            if self.quantize and self.device.type == "cuda":
+                model_kwargs["quantization_config"] = BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_quant_type="nf4",
+                    bnb_4bit_compute_dtype=torch.float16,
+                    bnb_4bit_use_double_quant=True
+                )
             
             self.model = AutoModelForCausalLM.from_pretrained(
                 model_name,
                 **model_kwargs
             )
-            
-            self.model.to(self.device)
             self.model.eval()
             
-            logger.info("Mistral model loaded successfully")
+            # FlashAttention-2 rejects a StaticCache in several transformers
+            # releases, so it keeps the default dynamic cache
+            attn_implementation = self.model.config._attn_implementation
+            self._static_cache = attn_implementation != "flash_attention_2"
+            logger.info(f"Recipe model attention: {attn_implementation}")
+            self.model = quantize_model(self.model, self.device, self.quantize)
+            
+            logger.info("Recipe model loaded successfully")
             
         except Exception as e:
-            logger.error(f"Failed to load Mistral model: {e}")
+            logger.error(f"Failed to load recipe model: {e}")
             # Fallback to a smaller model or mock responses
             logger.warning("Falling back to mock recipe generation")
             self.model = None
             self.tokenizer = None
     
-    def _generate_text(self, prompt: str, max_length: int = 1024) -> str:
-        """Generate text using the Mistral model"""
+    def _attn_implementation(self) -> Optional[str]:
+        """Pick FlashAttention-2 on GPU when installed, the transformers default otherwise"""
+        if self.device.type == "cuda" and is_flash_attn_2_available():
+            return "flash_attention_2"
+        return None
+    
+    def _load_vllm_engine(self) -> bool:
+        """Start a vLLM engine, which batches concurrent requests with PagedAttention"""
+        try:
+            from vllm import AsyncEngineArgs, AsyncLLMEngine
+        except ImportError:
+            logger.warning("vLLM is not installed, falling back to transformers")
+            return False
+        
+        try:
+            logger.info(f"Starting vLLM engine for {self.model_name}...")
+            
+            # The tokenizer is only needed for the chat template
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                self.model_name,
+                cache_dir=self.cache_dir
+            )
+            self.model = None
+            
+            # Reserve KV cache for the prompt and its answer rather than the
+            # model's full context window
+            prompt_tokens = len(self.tokenizer(self._build_prompt("")).input_ids)
+            max_model_len = prompt_tokens + _MAX_INGREDIENT_TOKENS + self.max_new_tokens
+            
+            # The image models share the GPU, so leave them room beside the KV cache
+            self.engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(
+                model=self.model_name,
+                download_dir=self.cache_dir,
+                dtype="float16" if self.device.type == "cuda" else "bfloat16",
+                gpu_memory_utilization=float(os.getenv("VLLM_GPU_MEMORY_UTILIZATION", 0.7)),
+                max_model_len=max_model_len,
+                enable_prefix_caching=True
+            ))
+            
+            logger.info("vLLM engine started successfully")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to start vLLM engine: {e}")
+            logger.warning("Falling back to transformers")
+            self.engine = None
+            self.tokenizer = None
+            return False
+    
+    def _load_onnx_model(self) -> bool:
+        """Load the recipe model as an ONNX Runtime graph for CPU inference"""
+        if self.device.type != "cpu":
+            logger.warning("ONNX Runtime engine is CPU only, falling back to transformers")
+            return False
+        
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM, ORTQuantizer
+        except ImportError:
+            logger.warning("optimum[onnxruntime] is not installed, falling back to transformers")
+            return False
+        
+        try:
+            # Point ONNX_MODEL_DIR at a pre-optimized (e.g. int4) export to skip exporting
+            model_dir = os.getenv("ONNX_MODEL_DIR")
+            onnx_dir = model_dir or os.path.join(
+                self.cache_dir, "onnx", self.model_name.replace("/", "--")
+            )
+            export = not os.path.isdir(onnx_dir)
+            
+            # A given ONNX_MODEL_DIR is served as is; our own export gets an
+            # int8 dynamically quantized copy next to it
+            quant_dir = onnx_dir + "-int8" if self.quantize and model_dir is None else None
+            load_model = functools.partial(
+                ORTModelForCausalLM.from_pretrained,
+                use_cache=True,
+                provider="CPUExecutionProvider",
+                cache_dir=self.cache_dir
+            )
+            
+            # The graph is written last, so its presence marks a finished quantization
+            if quant_dir is not None and os.path.isfile(os.path.join(quant_dir, "model_quantized.onnx")):
+                logger.info(f"Loading {self.model_name} with ONNX Runtime from {quant_dir}...")
+                self.tokenizer = AutoTokenizer.from_pretrained(quant_dir)
+                self.model = load_model(quant_dir, file_name="model_quantized.onnx")
+            else:
+                logger.info(f"Loading {self.model_name} with ONNX Runtime from {onnx_dir}...")
+                
+                self.tokenizer = AutoTokenizer.from_pretrained(
+                    onnx_dir if not export else self.model_name,
+                    cache_dir=self.cache_dir
+                )
+                self.model = load_model(self.model_name if export else onnx_dir, export=export)
+                
+                # Exporting is slow, so keep the graph for the next start
+                if export:
+                    self.model.save_pretrained(onnx_dir)
+                    self.tokenizer.save_pretrained(onnx_dir)
+                
+                if quant_dir is not None:
+                    logger.info("Quantizing ONNX recipe model to int8...")
+                    self.model.config.save_pretrained(quant_dir)
+                    self.tokenizer.save_pretrained(quant_dir)
+                    quantizer = ORTQuantizer.from_pretrained(onnx_dir, file_name="model.onnx")
+                    quantizer.quantize(
+                        save_dir=quant_dir,
+                        quantization_config=_ort_quantization_config()
+                    )
+                    self.model = load_model(quant_dir, file_name="model_quantized.onnx")
+            
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            
+            logger.info("ONNX Runtime recipe model loaded successfully")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to load ONNX Runtime model: {e}")
+            logger.warning("Falling back to transformers")
+            self.model = None
+            self.tokenizer = None
+            return False
+    
+    def _load_tgi_client(self) -> bool:
+        """Connect to a shared text-generation-inference server instead of loading weights"""
+        try:
+            import httpx
+        except ImportError:
+            logger.warning("httpx is not installed, falling back to transformers")
+            return False
+        
+        inference_url = os.getenv("INFERENCE_URL", "http://localhost:8080")
+        logger.info(f"Using inference server at {inference_url} for {self.model_name}")
+        
+        # The tokenizer is only needed for the chat template
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(
+                self.model_name,
+                cache_dir=self.cache_dir
+            )
+        except Exception as e:
+            logger.warning(f"Failed to load tokenizer, sending raw prompts: {e}")
+            self.tokenizer = None
+        self.model = None
+        
+        self.engine = httpx.AsyncClient(
+            base_url=inference_url,
+            timeout=float(os.getenv("INFERENCE_TIMEOUT", 120))
+        )
+        return True
+    
+    def _configure_compile(self) -> bool:
+        """Let generate() compile the decode step with CUDA graphs when running on GPU"""
+        generation_config = self.model.generation_config
+        
+        # generate() compiles on its own whenever a static cache is used on GPU,
+        # so opt out unless every condition below holds
+        generation_config.disable_compile = True
+        if not torch_compile_enabled(self.device, self.cache_dir):
+            return False
+        
+        # Without the static KV cache decode shapes change every step
+        if not self._static_cache:
+            logger.info("Static KV cache unavailable, skipping torch.compile")
+            return False
+        
+        # Some quantization backends, such as bitsandbytes, cannot be compiled
+        hf_quantizer = getattr(self.model, "hf_quantizer", None)
+        if hf_quantizer is not None and not hf_quantizer.is_compileable:
+            logger.info("Quantized recipe model cannot be compiled, using eager mode")
+            return False
+        
+        # Only the fixed-shape decode step is compiled; prefill, whose length
+        # changes with every ingredient list, stays eager
+        generation_config.disable_compile = False
+        generation_config.compile_config = CompileConfig(mode="reduce-overhead")
+        return True
+    
+    def _uses_chat_template(self) -> bool:
+        """Whether prompts are wrapped in the tokenizer's chat template"""
+        return self.tokenizer is not None and bool(getattr(self.tokenizer, "chat_template", None))
+    
+    def _template_bos(self) -> str:
+        """BOS text emitted by the chat template that a server's tokenizer would add again"""
+        if not self._uses_chat_template() or not self.tokenizer.bos_token:
+            return ""
+        
+        ids = self.tokenizer("a").input_ids
+        adds_bos = bool(ids) and ids[0] == self.tokenizer.bos_token_id
+        return self.tokenizer.bos_token if adds_bos else ""
+    
+    def _server_prompt(self, prompt: str) -> str:
+        """Prompt text for inference servers, without the BOS they add themselves"""
+        if self._server_bos and prompt.startswith(self._server_bos):
+            return prompt[len(self._server_bos):]
+        return prompt
+    
+    def _build_prompt(self, ingredients_str: str) -> str:
+        """Fill the recipe template and wrap it in the model's chat format"""
+        content = self.recipe_prompt_template.format(ingredients=ingredients_str)
+        
+        # Tokenizers without a chat template get the raw instruction prompt
+        if not self._uses_chat_template():
+            return content
+        
+        messages = [{"role": "user", "content": content}]
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+    
+    def _prepare_prefix_cache(self, with_kv: bool = True):
+        """Tokenize the static start of the prompt once and optionally keep its KV cache"""
+        try:
+            # Cut at the last line break before the ingredients so the prefix
+            # tokenizes the same way on its own as inside a full prompt
+            marker = "\0"
+            prompt = self._build_prompt(marker)
+            prefix = prompt[:prompt.rindex("\n", 0, prompt.index(marker)) + 1]
+            
+            # Chat templates already emit BOS and other special tokens
+            add_special_tokens = not self._uses_chat_template()
+            prefix_ids = self.tokenizer(
+                prefix,
+                add_special_tokens=add_special_tokens,
+                return_tensors="pt"
+            ).input_ids.to(self.device)
+            sample = self._build_prompt("tomato")
+            sample_ids = self.tokenizer(
+                sample,
+                add_special_tokens=add_special_tokens,
+                return_tensors="pt"
+            ).input_ids.to(self.device)
+            rest_ids = self.tokenizer(
+                sample[len(prefix):],
+                add_special_tokens=False,
+                return_tensors="pt"
+            ).input_ids.to(self.device)
+            if not torch.equal(sample_ids, torch.cat([prefix_ids, rest_ids], dim=1)):
+                logger.warning("Prompt prefix does not tokenize stably, prefix caching disabled")
+                return
+            
+            if with_kv:
+                with torch.no_grad():
+                    self._prefix_cache = self.model(prefix_ids, use_cache=True).past_key_values
+                logger.info(f"Cached KV for {prefix_ids.shape[1]}-token prompt prefix")
+            
+            self._prefix_text = prefix
+            self._prefix_ids = prefix_ids
+            
+        except Exception as e:
+            logger.warning(f"Failed to prepare prompt prefix cache: {e}")
+            self._prefix_text = None
+            self._prefix_ids = None
+            self._prefix_cache = None
+    
+    def _tokenize_prompt(self, prompt: str) -> torch.Tensor:
+        """Tokenize a prompt, reusing the cached ids of the static prefix"""
+        if self._prefix_ids is not None and prompt.startswith(self._prefix_text):
+            # Only the ingredient line and the chat suffix still need BPE
+            rest_ids = self.tokenizer(
+                prompt[len(self._prefix_text):],
+                add_special_tokens=False,
+                return_tensors="pt"
+            ).input_ids.to(self.device)
+            return torch.cat([self._prefix_ids, rest_ids], dim=1)
+        
+        # The template alone is several hundred tokens, so only guard against
+        # prompts beyond what the model supports
+        return self.tokenizer(
+            prompt,
+            add_special_tokens=not self._uses_chat_template(),
+            return_tensors="pt",
+            truncation=True,
+            max_length=self.tokenizer.model_max_length
+        ).input_ids.to(self.device)
+    
+    def _get_prefix_cache(self, input_ids: torch.Tensor):
+        """Return a private copy of the prefix KV cache if the prompt starts with the prefix"""
+        if self._prefix_cache is None:
+            return None
+        
+        prefix_len = self._prefix_ids.shape[1]
+        if input_ids.shape[1] <= prefix_len or not torch.equal(input_ids[0, :prefix_len], self._prefix_ids[0]):
+            return None
+        
+        # generate() extends the cache in place, so each call needs its own copy
+        return copy.deepcopy(self._prefix_cache)
+    
+    def _generate_text(self, prompt: str, max_length: Optional[int] = None) -> Optional[str]:
+        """Generate text using the recipe model, None if no model output is available"""
         if self.model is None or self.tokenizer is None:
-            return self._generate_mock_response(prompt)
+            return None
+        max_length = max_length or self.max_new_tokens
         
         try:
             # Tokenize input
-            inputs = self.tokenizer(
-                prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=512,
-                padding=True
-            ).to(self.device)
+            input_ids = self._tokenize_prompt(prompt)
+            inputs = {
+                "input_ids": input_ids,
+                "attention_mask": torch.ones_like(input_ids)
+            }
+            
+            # Greedy decoding: sampling only adds noise to structured JSON output
+            generate_kwargs = {
+                "max_new_tokens": max_length,
+                "do_sample": False,
+                "num_beams": 1,
+                "repetition_penalty": 1.1,
+                "pad_token_id": self.tokenizer.eos_token_id
+            }
+            
+            prefix_cache = self._get_prefix_cache(inputs["input_ids"])
+            if prefix_cache is not None:
+                # Only the tokens after the shared prefix need a prefill pass
+                generate_kwargs["past_key_values"] = prefix_cache
+            elif self._static_cache:
+                # Preallocated KV cache, reused and reset across calls
+                generate_kwargs["cache_implementation"] = "static"
             
             # Generate response
             with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_length,
-                    temperature=0.7,
-                    do_sample=True,
-                    top_p=0.9,
-                    top_k=50,
-                    repetition_penalty=1.1,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
+                outputs = self.model.generate(**inputs, **generate_kwargs)
             
             # Decode response
             generated_text = self.tokenizer.decode(
@@ -157,72 +642,138 @@ Make sure the recipes are practical, delicious, and use the available ingredient
             
         except Exception as e:
             logger.error(f"Failed to generate text: {e}")
-            return self._generate_mock_response(prompt)
+            return None
+    
+    def _generate_batch(self, prompts: List[str], max_length: Optional[int] = None) -> List[Optional[str]]:
+        """Generate text for several prompts with a single left-padded generate() call"""
+        # A lone prompt keeps the prefix KV cache fast path
+        if len(prompts) == 1 or self.model is None or self.tokenizer is None:
+            return [self._generate_text(prompt, max_length=max_length) for prompt in prompts]
+        max_length = max_length or self.max_new_tokens
+        
+        try:
+            # Left-pad so every sequence ends right where generation starts
+            prompt_ids = [self._tokenize_prompt(prompt)[0] for prompt in prompts]
+            seq_len = max(ids.shape[0] for ids in prompt_ids)
+            pad_token_id = self.tokenizer.pad_token_id
+            
+            input_ids = torch.full(
+                (len(prompts), seq_len),
+                pad_token_id,
+                dtype=prompt_ids[0].dtype,
+                device=self.device
+            )
+            attention_mask = torch.zeros_like(input_ids)
+            for row, ids in enumerate(prompt_ids):
+                input_ids[row, seq_len - ids.shape[0]:] = ids
+                attention_mask[row, seq_len - ids.shape[0]:] = 1
+            
+            generate_kwargs = {
+                "max_new_tokens": max_length,
+                "do_sample": False,
+                "num_beams": 1,
+                "repetition_penalty": 1.1,
+                "pad_token_id": pad_token_id
+            }
+            
+            # Not for ONNX Runtime, which manages its own KV buffers, or FlashAttention-2
+            if self._static_cache:
+                generate_kwargs["cache_implementation"] = "static"
+            
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    **generate_kwargs
+                )
+            
+            generated = self.tokenizer.batch_decode(
+                outputs[:, seq_len:],
+                skip_special_tokens=True
+            )
+            
+            return [text.strip() for text in generated]
+            
+        except Exception as e:
+            logger.error(f"Failed to generate batch of {len(prompts)} prompts: {e}")
+            return [None] * len(prompts)
+    
+    async def _generate_text_tgi(self, prompt: str, max_length: Optional[int] = None) -> Optional[str]:
+        """Generate text using the text-generation-inference server, None on failure"""
+        try:
+            response = await self.engine.post("/generate", json={
+                "inputs": self._server_prompt(prompt),
+                "parameters": {
+                    "max_new_tokens": max_length or self.max_new_tokens,
+                    "do_sample": False,
+                    "repetition_penalty": 1.1,
+                    "return_full_text": False
+                }
+            })
+            response.raise_for_status()
+            
+            return orjson.loads(response.content)["generated_text"].strip()
+            
+        except Exception as e:
+            logger.error(f"Failed to generate text with inference server: {e}")
+            return None
+    
+    async def _generate_text_vllm(self, prompt: str, max_length: Optional[int] = None) -> Optional[str]:
+        """Generate text using the vLLM engine, None on failure"""
+        from vllm import SamplingParams
+        
+        try:
+            sampling_params = SamplingParams(
+                max_tokens=max_length or self.max_new_tokens,
+                temperature=0.0,
+                repetition_penalty=1.1
+            )
+            
+            # The engine streams partial outputs; keep the final one
+            final_output = None
+            async for output in self.engine.generate(
+                self._server_prompt(prompt),
+                sampling_params,
+                request_id=uuid.uuid4().hex
+            ):
+                final_output = output
+            
+            return final_output.outputs[0].text.strip()
+            
+        except Exception as e:
+            logger.error(f"Failed to generate text: {e}")
+            return None
     
     def _generate_mock_response(self, prompt: str) -> str:
         """Generate mock recipe response when model is not available"""
         logger.info("Generating mock recipe response")
         
         # Extract ingredients from prompt
-        ingredients_match = re.search(r'Available ingredients: (.+)', prompt)
+        ingredients_match = _INGREDIENTS_RE.search(prompt)
         ingredients = []
         if ingredients_match:
             ingredients_text = ingredients_match.group(1)
-            ingredients = [ing.strip() for ing in ingredients_text.split(',')]
-        
-        # Create mock recipes
-        mock_recipes = {
-            "recipes": [
-                {
-                    "name": f"Quick {ingredients[0] if ingredients else 'Vegetable'} Stir Fry",
-                    "description": f"A delicious and quick stir fry featuring {', '.join(ingredients[:3]) if len(ingredients) >= 3 else 'fresh ingredients'}",
-                    "ingredients": ingredients + ["soy sauce", "garlic", "ginger", "oil"],
-                    "instructions": [
-                        "Heat oil in a large pan or wok over medium-high heat",
-                        "Add garlic and ginger, stir for 30 seconds",
-                        f"Add {ingredients[0] if ingredients else 'vegetables'} and cook for 3-4 minutes",
-                        "Add remaining ingredients and stir fry for 2-3 minutes",
-                        "Season with soy sauce and serve hot"
-                    ],
-                    "prep_time": "10 minutes",
-                    "cook_time": "8 minutes",
-                    "servings": 2,
-                    "difficulty": "Easy",
-                    "cuisine_type": "Asian"
-                },
-                {
-                    "name": f"Simple {ingredients[1] if len(ingredients) > 1 else 'Garden'} Salad",
-                    "description": f"Fresh and healthy salad with {', '.join(ingredients[:2]) if len(ingredients) >= 2 else 'seasonal ingredients'}",
-                    "ingredients": ingredients + ["olive oil", "lemon juice", "salt", "pepper"],
-                    "instructions": [
-                        "Wash and prepare all vegetables",
-                        "Cut ingredients into bite-sized pieces",
-                        "Combine all ingredients in a large bowl",
-                        "Drizzle with olive oil and lemon juice",
-                        "Season with salt and pepper, toss and serve"
-                    ],
-                    "prep_time": "15 minutes",
-                    "cook_time": "0 minutes",
-                    "servings": 2,
-                    "difficulty": "Easy",
-                    "cuisine_type": "Mediterranean"
-                }
-            ]
-        }
+            ingredients = [ing.strip() for ing in ingredients_text.split(',') if ing.strip()]
         
-        return json.dumps(mock_recipes, indent=2)
+        return _mock_recipes_json(tuple(ingredients))
     
     def _parse_recipe_response(self, response: str) -> List[Recipe]:
         """Parse the AI response into Recipe objects"""
+        recipes = self._parse_recipes(response)
+        if recipes is None:
+            return self._fallback_recipes()
+        return recipes
+    
+    def _parse_recipes(self, response: str) -> Optional[List[Recipe]]:
+        """Parse the AI response into Recipe objects, None if it is not valid recipe JSON"""
         try:
             # Try to extract JSON from the response
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                data = json.loads(json_str)
+            json_str = _find_json_object(response)
+            if json_str is not None:
+                data = orjson.loads(json_str)
             else:
                 # If no JSON found, try to parse the entire response
-                data = json.loads(response)
+                data = orjson.loads(response)
             
             recipes = []
             for recipe_data in data.get("recipes", []):
@@ -244,53 +795,95 @@ Make sure the recipes are practical, delicious, and use the available ingredient
         except Exception as e:
             logger.error(f"Failed to parse recipe response: {e}")
             logger.debug(f"Response was: {response}")
-            
-            # Return a fallback recipe
-            return [Recipe(
-                name="Simple Mixed Dish",
-                description="A simple dish using your available ingredients",
-                ingredients=["Your available ingredients", "Salt", "Pepper", "Oil"],
-                instructions=[
-                    "Prepare all ingredients",
-                    "Cook according to your preference",
-                    "Season to taste",
-                    "Serve hot"
-                ],
-                prep_time="10 minutes",
-                cook_time="15 minutes",
-                servings=2,
-                difficulty="Easy",
-                cuisine_type="Home Cooking"
-            )]
+            return None
+    
+    def _fallback_recipes(self) -> List[Recipe]:
+        """Generic recipe returned when the model output cannot be used"""
+        return [Recipe(
+            name="Simple Mixed Dish",
+            description="A simple dish using your available ingredients",
+            ingredients=["Your available ingredients", "Salt", "Pepper", "Oil"],
+            instructions=[
+                "Prepare all ingredients",
+                "Cook according to your preference",
+                "Season to taste",
+                "Serve hot"
+            ],
+            prep_time="10 minutes",
+            cook_time="15 minutes",
+            servings=2,
+            difficulty="Easy",
+            cuisine_type="Home Cooking"
+        )]
+    
+    async def warm_up(self):
+        """Compile the decode step and record its CUDA graphs before real traffic"""
+        if not self._compiled:
+            return
+        
+        # Uses the full token budget so the static cache it allocates is reused
+        # by real requests; queued through the batcher so they wait behind it
+        logger.info("Warming up compiled recipe model...")
+        await self._batcher.submit(self._build_prompt("tomato"))
+    
+    async def close(self):
+        """Release the connection pool of the inference server client"""
+        if self.engine_type == "tgi":
+            await self.engine.aclose()
     
     async def generate_recipes(self, ingredients: List[str]) -> List[Recipe]:
         """
         Generate recipes based on available ingredients
         """
         try:
-            if not ingredients:
+            # Normalize once; the prompt is built from the same tuple as the
+            # cache key, so equal keys always mean identical prompts
+            key = tuple(dict.fromkeys(ing.lower().strip() for ing in ingredients if ing.strip()))
+            if not key:
                 raise ValueError("No ingredients provided")
             
+            # Serve repeated ingredient lists from the cache
+            cached = self._recipe_cache.get(key)
+            if cached is not None:
+                logger.info(f"Using {len(cached)} cached recipes")
+                return list(cached)
+            
             # Create prompt
-            ingredients_str = ", ".join(ingredients)
-            prompt = self.recipe_prompt_template.format(ingredients=ingredients_str)
+            ingredients_str = ", ".join(key)
+            prompt = self._build_prompt(ingredients_str)
             
             logger.info(f"Generating recipes for ingredients: {ingredients_str}")
             
-            # Generate recipes using AI model
-            response = await asyncio.to_thread(
-                self._generate_text, 
-                prompt, 
-                max_length=1024
-            )
+            # Generate recipes using AI model; None means there is no usable output
+            if self.engine_type == "vllm":
+                # vLLM schedules and batches requests itself
+                response = await self._generate_text_vllm(prompt)
+            elif self.engine_type == "tgi":
+                # So does the inference server
+                response = await self._generate_text_tgi(prompt)
+            elif self.model is None:
+                response = None
+            else:
+                response = await self._batcher.submit(prompt)
             
-            logger.debug(f"AI Response: {response}")
+            if response is None:
+                # Mock recipes are plain string formatting, not worth a worker
+                # thread, and are not cached so a recovered model is used again
+                return self._parse_recipe_response(self._generate_mock_response(prompt))
+            
+            # Lazy formatting, the full response is large and rarely logged
+            logger.debug("AI Response: %s", response)
             
             # Parse response into Recipe objects
-            recipes = self._parse_recipe_response(response)
+            recipes = self._parse_recipes(response)
+            if not recipes:
+                logger.warning("Model response contained no usable recipes, not caching it")
+                return self._fallback_recipes()
             
             logger.info(f"Generated {len(recipes)} recipes")
             
+            self._recipe_cache.put(key, tuple(recipes))
+            
             return recipes
             
         except Exception as e:
@@ -0,0 +1,72 @@
+"""
+Tests for Micro-batching Service
+"""
+
+import pytest
+import asyncio
+import threading
+
+from services.batching import MicroBatcher
+
+class TestMicroBatcher:
+    """Test cases for MicroBatcher"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_items_share_batch(self):
+        """Test that concurrent submissions are processed in one call"""
+        calls = []
+        
+        def double(items):
+            calls.append(list(items))
+            return [item * 2 for item in items]
+        
+        batcher = MicroBatcher(double, max_batch_size=8, max_wait=0.01)
+        
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(3)))
+        
+        assert results == [0, 2, 4]
+        assert calls == [[0, 1, 2]]
+    
+    @pytest.mark.asyncio
+    async def test_max_batch_size(self):
+        """Test that batches never exceed the configured size"""
+        calls = []
+        
+        def identity(items):
+            calls.append(len(items))
+            return items
+        
+        batcher = MicroBatcher(identity, max_batch_size=2, max_wait=0.01)
+        
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+        
+        assert results == [0, 1, 2, 3, 4]
+        assert max(calls) <= 2
+    
+    @pytest.mark.asyncio
+    async def test_batch_error_propagates(self):
+        """Test that a failing batch raises for every caller"""
+        def fail(items):
+            raise RuntimeError("model failure")
+        
+        batcher = MicroBatcher(fail, max_wait=0.01)
+        
+        with pytest.raises(RuntimeError):
+            await batcher.submit(1)
+    
+    @pytest.mark.asyncio
+    async def test_batches_run_on_one_thread(self):
+        """Test that every batch runs on the same dedicated thread"""
+        threads = set()
+        
+        def record(items):
+            threads.add(threading.get_ident())
+            return items
+        
+        batcher = MicroBatcher(record, max_batch_size=1, max_wait=0)
+        
+        for i in range(4):
+            await asyncio.gather(batcher.submit(i), asyncio.to_thread(lambda: None))
+        
+        assert len(threads) == 1
+        assert threading.get_ident() not in threads
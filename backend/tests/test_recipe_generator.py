@@ -6,6 +6,7 @@ import pytest
 import asyncio
 from unittest.mock import Mock, patch
 import json
+import httpx
 
 from services.recipe_generator import RecipeGenerator
 from models.schemas import Recipe
@@ -13,7 +14,7 @@ from models.schemas import Recipe
 class TestRecipeGenerator:
     """Test cases for RecipeGenerator"""
     
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def mock_recipe_generator(self):
         """Create a mock recipe generator for testing"""
         with patch('services.recipe_generator.AutoTokenizer'), \
@@ -62,13 +63,27 @@ class TestRecipeGenerator:
         assert isinstance(recipes[0], Recipe)
         assert recipes[0].name == "Test Recipe"
     
+    def test_parse_recipe_response_with_surrounding_text(self, mock_recipe_generator):
+        """Test that the first JSON object is extracted from chatty output"""
+        mock_response = (
+            'Here you go: {"recipes": [{"name": "Brace {Test}", '
+            '"description": "Uses \\"quotes\\" and }", "ingredients": ["egg"], '
+            '"instructions": ["cook"]}]} Enjoy! {"not": "this"}'
+        )
+        
+        recipes = mock_recipe_generator._parse_recipe_response(mock_response)
+        
+        assert len(recipes) == 1
+        assert recipes[0].name == "Brace {Test}"
+        assert recipes[0].description == 'Uses "quotes" and }'
+    
     @pytest.mark.asyncio
-    async def test_generate_recipes_success(self, mock_recipe_generator):
+    async def test_generate_recipes_success(self, mock_recipe_generator, monkeypatch):
         """Test successful recipe generation"""
         test_ingredients = ["tomato", "onion", "chicken"]
         
         # Mock the text generation to return a valid response
-        mock_recipe_generator._generate_text = Mock(return_value=json.dumps({
+        monkeypatch.setattr(mock_recipe_generator, "_generate_text", Mock(return_value=json.dumps({
             "recipes": [
                 {
                     "name": "Chicken Stir Fry",
@@ -82,7 +97,7 @@ class TestRecipeGenerator:
                     "cuisine_type": "Asian"
                 }
             ]
-        }))
+        })))
         
         recipes = await mock_recipe_generator.generate_recipes(test_ingredients)
         
@@ -94,4 +109,78 @@ class TestRecipeGenerator:
     async def test_generate_recipes_empty_ingredients(self, mock_recipe_generator):
         """Test recipe generation with empty ingredients"""
         with pytest.raises(ValueError):
-            await mock_recipe_generator.generate_recipes([]) 
\ No newline at end of file
+            await mock_recipe_generator.generate_recipes([]) 
+    
+    @pytest.mark.asyncio
+    async def test_generate_recipes_cached(self, mock_recipe_generator, monkeypatch):
+        """Test that repeated ingredient sets reuse cached recipes"""
+        monkeypatch.setattr(mock_recipe_generator, "_generate_text", Mock(
+            return_value=mock_recipe_generator._generate_mock_response(
+                "Available ingredients: tomato, onion"
+            )
+        ))
+        
+        first = await mock_recipe_generator.generate_recipes(["tomato", "onion"])
+        second = await mock_recipe_generator.generate_recipes(["Tomato ", "onion"])
+        
+        assert second == first
+        assert mock_recipe_generator._generate_text.call_count == 1
+        
+        # Order shapes the prompt, so a reordered list is a different key
+        await mock_recipe_generator.generate_recipes(["onion", "tomato"])
+        assert mock_recipe_generator._generate_text.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_generate_recipes_failures_not_cached(self, mock_recipe_generator, monkeypatch):
+        """Test that failed generations and unparseable output are retried"""
+        monkeypatch.setattr(mock_recipe_generator, "_generate_text", Mock(
+            side_effect=[None, "not json", None]
+        ))
+        monkeypatch.setattr(mock_recipe_generator, "tokenizer", None)
+        
+        for _ in range(3):
+            recipes = await mock_recipe_generator.generate_recipes(["lentils"])
+            assert len(recipes) > 0
+        
+        assert mock_recipe_generator._generate_text.call_count == 3
+    
+    @pytest.mark.asyncio
+    async def test_generate_recipes_inference_server(self, mock_recipe_generator, monkeypatch):
+        """Test recipe generation through a text-generation-inference server"""
+        requests_seen = []
+        
+        def handler(request):
+            requests_seen.append(json.loads(request.content))
+            return httpx.Response(200, json={
+                "generated_text": mock_recipe_generator._generate_mock_response(
+                    "Available ingredients: rice, beans"
+                )
+            })
+        
+        monkeypatch.setattr(mock_recipe_generator, "engine_type", "tgi")
+        monkeypatch.setattr(mock_recipe_generator, "tokenizer", None)
+        monkeypatch.setattr(mock_recipe_generator, "engine", httpx.AsyncClient(
+            base_url="http://tgi",
+            transport=httpx.MockTransport(handler)
+        ))
+        
+        recipes = await mock_recipe_generator.generate_recipes(["rice", "beans"])
+        
+        assert len(requests_seen) == 1
+        assert "rice, beans" in requests_seen[0]["inputs"]
+        assert requests_seen[0]["parameters"]["do_sample"] is False
+        assert recipes[0].name == "Quick rice Stir Fry"
+    
+    @pytest.mark.asyncio
+    async def test_warm_up_runs_only_when_compiled(self, mock_recipe_generator, monkeypatch):
+        """Test that warmup generates once through the batcher for a compiled model"""
+        monkeypatch.setattr(mock_recipe_generator, "tokenizer", None)
+        monkeypatch.setattr(mock_recipe_generator, "_generate_text", Mock(return_value="{}"))
+        
+        monkeypatch.setattr(mock_recipe_generator, "_compiled", False)
+        await mock_recipe_generator.warm_up()
+        assert mock_recipe_generator._generate_text.call_count == 0
+        
+        monkeypatch.setattr(mock_recipe_generator, "_compiled", True)
+        await mock_recipe_generator.warm_up()
+        assert mock_recipe_generator._generate_text.call_count == 1